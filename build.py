@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+from argparse import ArgumentParser
+import mmap
+import os
+from pathlib import Path
+import platform
+import shutil
+from subprocess import PIPE, Popen, run
+import sys
+from threading import Thread
+
+try:
+    from orjson import loads
+except ImportError:
+    from json import loads
+
+# platform.system() is surprisingly expensive on first use (a uname or
+# registry lookup) so resolve the host once at import.
+_SYSTEM = platform.system()
+
+# The cargo packages to build and, for each, the name and kind of the cargo
+# target whose compiler-artifact message carries the output we want.
+_TARGETS = {
+    'kernel': ('obkrnl', 'bin'),
+    'core': ('core', 'staticlib'),
+}
+
+
+def cargo_start(release, sccache=True, jobs=None):
+    # A release build is a one-shot distribution build that will never reuse
+    # the incremental artifacts, so skip the cost of producing them (see
+    # matklad's "Fast Rust Builds").
+    env = os.environ.copy()
+
+    if release:
+        env['CARGO_INCREMENTAL'] = '0'
+
+    # Compile through sccache when it is installed so crates that did not
+    # change come from its cache. Incremental compilation must be off for
+    # that because the two are incompatible.
+    if sccache:
+        wrapper = shutil.which('sccache')
+
+        if wrapper:
+            env['RUSTC_WRAPPER'] = wrapper
+            env['CARGO_INCREMENTAL'] = '0'
+
+    # Everything we need comes through the JSON stream so stop cargo from
+    # writing status and progress output on top of it.
+    env['CARGO_TERM_QUIET'] = 'true'
+    env['CARGO_TERM_PROGRESS_WHEN'] = 'never'
+
+    # Pin the target directory so every invocation populates the same
+    # incremental cache no matter what directory or environment the script is
+    # run from. It has to stay at this exact path because src/CMakeLists.txt
+    # expects the artifacts there.
+    env['CARGO_TARGET_DIR'] = os.path.abspath(os.path.join('src', 'target'))
+
+    # Launch the build. One invocation builds every package: cargo holds an
+    # exclusive lock on the build directory so separate processes would just
+    # serialize on it, while a single process parallelizes across the
+    # packages' dependency graphs.
+    cmd = ['cargo', 'build']
+
+    for package in _TARGETS:
+        cmd.extend(['-p', package])
+
+    if release:
+        cmd.append('-r')
+
+    if jobs is not None:
+        cmd.extend(['-j', str(jobs)])
+        env['CARGO_BUILD_JOBS'] = str(jobs)
+
+    cmd.extend(['--message-format', 'json-render-diagnostics'])
+
+    # A large read buffer lets one syscall drain many JSON lines at once.
+    # Keep close_fds explicit and avoid preexec_fn/pass_fds so CPython can
+    # launch the child with posix_spawn instead of forking the whole
+    # interpreter; on glibc >= 2.29 the cwd is handled by addchdir so it does
+    # not defeat the fast path either.
+    return Popen(cmd, cwd='src', stdout=PIPE, env=env, bufsize=1024 * 1024, close_fds=True)
+
+
+def cargo_finish(proc):
+    # Harvest the artifact of every wanted target from the JSON stream. The
+    # stream stays as bytes end-to-end: everything except the handful of
+    # compiler-artifact lines is rejected on the raw bytes without decoding
+    # it, and without the newline translation a text-mode pipe would do on
+    # Windows.
+    artifacts = {}
+
+    with proc:
+        for line in proc.stdout:
+            if b'"reason":"compiler-artifact"' not in line:
+                continue
+
+            line = loads(line)
+            t = line['target']
+
+            for package, (name, kind) in _TARGETS.items():
+                if t['name'] == name and kind in t['kind']:
+                    artifacts[package] = line
+
+    return proc.returncode, artifacts
+
+
+def build_rust(release, sccache=True, jobs=None):
+    status, artifacts = cargo_finish(cargo_start(release, sccache, jobs))
+
+    if status != 0:
+        sys.exit('Failed to build the Rust packages.')
+
+    for package in _TARGETS:
+        if package not in artifacts:
+            sys.exit(f'No artifact produced for {package}.')
+
+    return artifacts['kernel']
+
+
+def cmake_preset(release):
+    if _SYSTEM == 'Darwin':
+        os_name = 'mac'
+    elif _SYSTEM == 'Linux':
+        os_name = 'linux'
+    elif _SYSTEM == 'Windows':
+        os_name = 'windows'
+    else:
+        sys.exit(f'Unsupported platform: {_SYSTEM}.')
+
+    return os_name + ('-release' if release else '-debug')
+
+
+def build_gui(release, jobs=None):
+    preset = cmake_preset(release)
+    env = os.environ.copy()
+
+    if jobs is not None:
+        env['CMAKE_BUILD_PARALLEL_LEVEL'] = str(jobs)
+
+    run(['cmake', '--preset', preset, '.'], check=True, env=env)
+    run(['cmake', '--build', '--preset', preset], check=True, env=env)
+
+    # Get the path of the output executable.
+    if _SYSTEM == 'Darwin':
+        return os.path.join('build', 'src', 'obliteration.app')
+    elif _SYSTEM == 'Windows':
+        return os.path.join('build', 'src', 'Obliteration.exe')
+    else:
+        return os.path.join('build', 'src', 'obliteration')
+
+
+def up_to_date(src, dst, sized=True):
+    # An exported file is current when the destination is at least as new as
+    # the source (copies carry the source timestamp over, see install) and,
+    # unless the destination was rewritten after the copy, the same size.
+    try:
+        d = os.stat(dst)
+    except FileNotFoundError:
+        return False
+
+    s = os.stat(src)
+
+    if sized and s.st_size != d.st_size:
+        return False
+
+    return s.st_mtime_ns <= d.st_mtime_ns
+
+
+def install(src, dir, executable=False, link=False):
+    dst = os.path.join(dir, os.path.basename(src))
+
+    # When exporting into an existing directory (--root) skip files that are
+    # already up to date so iterating on the non-Rust parts does not re-copy
+    # the kernel.
+    if up_to_date(src, dst):
+        return dst
+
+    s = os.stat(src)
+
+    # For the developer loop the destination lives on the same filesystem as
+    # target/ so a hardlink makes the export free regardless of file size.
+    if link and s.st_dev == os.stat(dir).st_dev:
+        try:
+            os.link(src, dst)
+        except OSError:
+            pass
+        else:
+            return dst
+
+    # shutil.copy preserves permissions with an extra pass over the file while
+    # copyfile takes the in-kernel copy path (sendfile/fcopyfile/CopyFileW),
+    # so use the latter and only restore the mode where it matters.
+    shutil.copyfile(src, dst)
+
+    # Carry the source timestamp over so the next export can tell the copy is
+    # current.
+    os.utime(dst, ns=(s.st_atime_ns, s.st_mtime_ns))
+
+    if executable:
+        shutil.copymode(src, dst)
+
+    return dst
+
+
+# Directory skeleton of the export layout for each platform, as the deepest
+# paths only so each leaf creates its ancestors in the same makedirs call.
+_LAYOUTS = {
+    # The bundle skeleton is staged by export_darwin itself so an up-to-date
+    # re-export does not leave an empty staging directory behind.
+    'Darwin': (),
+    'Linux': ('bin',),
+    'Windows': (),
+}
+
+
+def make_layout(root):
+    # The root itself is not implied by the leaves on every platform (Windows
+    # has none) so create it explicitly for a --root that does not exist yet.
+    os.makedirs(root, exist_ok=True)
+
+    for leaf in _LAYOUTS[_SYSTEM]:
+        os.makedirs(os.path.join(root, leaf), exist_ok=True)
+
+
+def prefault(path):
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+
+        if size == 0:
+            return
+
+        with mmap.mmap(f.fileno(), size, prot=mmap.PROT_READ) as m:
+            if hasattr(m, 'madvise'):
+                m.madvise(mmap.MADV_WILLNEED)
+
+
+def export_darwin(root, kern, gui, link=False):
+    # Stage the bundle under a temporary name and rename it into place once it
+    # is complete. This keeps a partially exported bundle from ever being
+    # visible and lets the many small metadata writes be flushed with a single
+    # fsync of the parent directory instead of one journal flush per file.
+    bundle = Path(root) / 'Obliteration.app'
+    staging = bundle.with_name('Obliteration.app.tmp')
+    gui = Path(gui) / 'Contents'
+
+    # When exporting into the same root again (--root) skip the whole
+    # stage/sign/swap while the published bundle is still current, otherwise
+    # the staging into a fresh directory would re-copy and re-sign everything
+    # on every run. The signed kernel cannot be compared by size because
+    # codesign grew it, but a copy at least as new as the source was made
+    # from the same input.
+    final = bundle / 'Contents'
+    exe = os.path.basename(kern['executable'])
+
+    if (up_to_date(gui / 'Info.plist', final / 'Info.plist')
+            and up_to_date(gui / 'MacOS' / 'obliteration', final / 'MacOS' / 'obliteration')
+            and up_to_date(gui / 'Resources' / 'obliteration.icns', final / 'Resources' / 'obliteration.icns')
+            and up_to_date(kern['executable'], final / 'MacOS' / exe, sized=False)):
+        return
+
+    # Create the staging skeleton, dropping whatever an interrupted run left
+    # behind. Precomputing the prefixes once avoids the repeated
+    # join/normalization of building every path from root.
+    contents = staging / 'Contents'
+    macos = contents / 'MacOS'
+    resources = contents / 'Resources'
+
+    shutil.rmtree(staging, onerror=report_undeleted)
+    macos.mkdir(parents=True)
+    resources.mkdir()
+
+    # Copy the GUI and its bundle metadata.
+    install(gui / 'Info.plist', contents, link=link)
+    install(gui / 'MacOS' / 'obliteration', macos, executable=True, link=link)
+    install(gui / 'Resources' / 'obliteration.icns', resources, link=link)
+
+    # Copy the kernel then sign it with the entitlements it requires. Never
+    # link it because codesign rewrites the file, which would corrupt the
+    # build output it shares an inode with.
+    kern = install(kern['executable'], macos, executable=True)
+
+    # Ask the kernel to pre-read the file so codesign finds it in the page
+    # cache when it comes back to hash it.
+    prefault(kern)
+
+    run([
+        'codesign', '-s', '-', '--entitlements', 'entitlements.plist', kern
+    ], check=True)
+
+    # Publish the bundle and flush the directory once. A bundle left from a
+    # previous export into the same root has to go first because a directory
+    # cannot be renamed onto a non-empty one.
+    shutil.rmtree(bundle, onerror=report_undeleted)
+    os.replace(staging, bundle)
+
+    fd = os.open(root, os.O_RDONLY | os.O_DIRECTORY)
+
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def export_linux(root, kern, gui, link=False):
+    bin = Path(root) / 'bin'
+
+    install(kern['executable'], bin, executable=True, link=link)
+    install(gui, bin, executable=True, link=link)
+
+
+def export_windows(root, kern, gui, link=False):
+    install(kern['executable'], root, link=link)
+    install(gui, root, link=link)
+
+
+def report_undeleted(func, path, exc):
+    # rmtree error handler: a path that is already gone is fine, anything
+    # else is reported without failing the build.
+    if not isinstance(exc[1], FileNotFoundError):
+        print(f'warning: cannot delete {path}: {exc[1]}', file=sys.stderr)
+
+
+def main():
+    # Parse arguments.
+    p = ArgumentParser(description='Script to build Obliteration and create a distribution directory.')
+    p.add_argument('-r', '--release', action='store_true', help='build in release mode')
+    p.add_argument('--root', help='directory to store the outputs (default: ./dist)')
+    p.add_argument('--no-sccache', action='store_true', help='do not compile through sccache (which is a no-op when it is not installed)')
+    p.add_argument('-j', '--jobs', type=int, help='number of parallel jobs for cargo and cmake (default: let them decide)')
+
+    args = p.parse_args()
+
+    # Prepare destination directory. Deleting the previous output is O(files)
+    # so push it aside and delete it in the background while the build runs,
+    # then stage the new export next to it and swap once it is complete.
+    dest = args.root
+    swap = None
+    cleanup = None
+
+    if dest is None:
+        # Removing unconditionally saves a stat per directory and avoids the
+        # race an exists check would open between the check and the removal.
+        # Undeletable files (commonly held open by an AV scanner on Windows)
+        # are reported instead of aborting the build.
+        shutil.rmtree('dist.old', onerror=report_undeleted)
+
+        try:
+            os.replace('dist', 'dist.old')
+        except FileNotFoundError:
+            pass
+        except OSError:
+            # On Windows the rename itself fails while something (commonly an
+            # AV scanner) holds a file inside open. Fall back to deleting in
+            # place and exporting straight into dist, skipping the swap.
+            shutil.rmtree('dist', onerror=report_undeleted)
+            os.makedirs('dist', exist_ok=True)
+            dest = 'dist'
+        else:
+            cleanup = Thread(target=shutil.rmtree, args=('dist.old',), kwargs={'onerror': report_undeleted})
+            cleanup.start()
+
+        if dest is None:
+            shutil.rmtree('dist.new', onerror=report_undeleted)
+            os.makedirs('dist.new')
+
+            dest = 'dist.new'
+            swap = 'dist'
+
+    # Build.
+    kern = build_rust(args.release, sccache=not args.no_sccache, jobs=args.jobs)
+    gui = build_gui(args.release, jobs=args.jobs)
+
+    # Export. A release export should be an independent artifact so only link
+    # the outputs for dev builds.
+    make_layout(dest)
+
+    link = not args.release
+
+    if _SYSTEM == 'Darwin':
+        export_darwin(dest, kern, gui, link=link)
+    elif _SYSTEM == 'Linux':
+        export_linux(dest, kern, gui, link=link)
+    elif _SYSTEM == 'Windows':
+        export_windows(dest, kern, gui, link=link)
+
+    if swap is not None:
+        os.replace(dest, swap)
+
+    if cleanup is not None and cleanup.is_alive():
+        cleanup.join()
+
+
+if __name__ == '__main__':
+    main()